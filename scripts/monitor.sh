@@ -12,8 +12,9 @@ while true; do
     tput cup 0 0
 
     # Count files
-    INPUT_COUNT=$(find "$INPUT_DIR" -name "*.md" 2>/dev/null | wc -l)
-    OUTPUT_COUNT=$(find "$OUTPUT_DIR" -name "*.md" 2>/dev/null | wc -l)
+    # -maxdepth 1: output-raw/skipped/ holds text-free PDFs that are never cleaned
+    INPUT_COUNT=$(find "$INPUT_DIR" -maxdepth 1 -name "*.md" 2>/dev/null | wc -l)
+    OUTPUT_COUNT=$(find "$OUTPUT_DIR" -maxdepth 1 -name "*.md" 2>/dev/null | wc -l)
     REMAINING=$((INPUT_COUNT - OUTPUT_COUNT))
     [ "$INPUT_COUNT" -gt 0 ] && PERCENT=$((OUTPUT_COUNT * 100 / INPUT_COUNT)) || PERCENT=0
 
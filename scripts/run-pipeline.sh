@@ -0,0 +1,15 @@
+#!/bin/bash
+# Steps 1-4 as one streaming pipeline (PyMuPDF extraction overlaps Ollama steps)
+
+PDF_DIR="/home/craigtrim/data/maryville/transcripts"
+MODEL="qwen2.5:7b"
+
+cd /home/craigtrim/projects/gpu-text-harvest
+
+echo "=== Streaming Pipeline: Extract -> Clean -> Legend -> CSV ==="
+echo "Input:  $PDF_DIR"
+echo "Output: ./output-raw, ./output-clean, ./output-legend-chunk, ./output-legend-csv"
+echo "Model:  $MODEL"
+echo ""
+
+python src/harvest_pipeline.py "$PDF_DIR" -o . -m $MODEL -w 8 "$@"
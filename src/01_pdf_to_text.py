@@ -2,67 +2,250 @@
 """
 Step 1: Fast PDF text extraction using PyMuPDF.
 
-Extracts raw text from PDF files in parallel.
+Extracts raw text from PDF files in parallel. Large PDFs are additionally
+split into page ranges and extracted in parallel when workers are idle.
+
+PDFs with almost no text layer (scanned images) or that fail to open are
+written to <output>/skipped/ instead and listed in <output>/skip_manifest.json,
+so the LLM steps never see them.
 
 Usage:
     python 01_pdf_to_text.py /path/to/pdfs -o ./output-raw
     python 01_pdf_to_text.py /path/to/pdfs -o ./output-raw -n 100  # limit to 100 files
+    python 01_pdf_to_text.py /path/to/pdfs -o ./output-raw --min-density 0  # only skip PDFs that fail
 """
 
 import argparse
+import multiprocessing
 import os
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
 from pathlib import Path
 
 import fitz  # PyMuPDF
+import orjson
+
+
+# Plain-text extraction flags, pinned so output doesn't drift with PyMuPDF's
+# defaults. Image blocks are never turned into pseudo-text.
+TEXT_FLAGS = (fitz.TEXT_PRESERVE_WHITESPACE
+              | fitz.TEXT_PRESERVE_LIGATURES
+              | fitz.TEXT_MEDIABOX_CLIP) & ~fitz.TEXT_PRESERVE_IMAGES
+
+PAGE_SPLIT_THRESHOLD = 50  # only split PDFs with more pages than this
+PAGES_PER_RANGE = 25  # minimum pages per parallel range
+
+# PyMuPDF leaks small allocations over long runs; recycle workers after about
+# this many PDFs each so RSS stays flat across large corpora
+MAX_TASKS_PER_CHILD = 200
+
+DEFAULT_MIN_DENSITY = 200  # chars per page below which a PDF has no usable text layer
+SKIPPED_DIR = "skipped"
+SKIP_MANIFEST = "skip_manifest.json"
+
+# Per-process state, set by the pool initializers
+_cpu_slots = None  # shared semaphore, one slot per worker process
+_workers = 1
+_page_doc = None  # document opened once per page-range worker
+
+
+class RecyclingProcessPool(Executor):
+    """Process pool swapped for a fresh one every max_workers * max_tasks_per_child submissions.
+
+    Stands in for ProcessPoolExecutor(max_tasks_per_child=...), which on
+    Python 3.11 stops spawning replacement workers and deadlocks once workers
+    start retiring (gh-115634). A retired pool finishes its queued work and
+    its workers exit; process_pdf's shared cpu_slots keep the overlap from
+    oversubscribing the CPU.
+    """
+
+    def __init__(self, max_workers: int, mp_context=None, initializer=None, initargs=(),
+                 max_tasks_per_child: int = MAX_TASKS_PER_CHILD):
+        self._pool_args = dict(max_workers=max_workers, mp_context=mp_context,
+                               initializer=initializer, initargs=initargs)
+        self._limit = max_workers * max_tasks_per_child
+        self._submitted = 0
+        self._pool = None
+        self._retired = []
+
+    def submit(self, fn, /, *args, **kwargs):
+        if self._pool is None or self._submitted >= self._limit:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._retired.append(self._pool)
+            self._pool = ProcessPoolExecutor(**self._pool_args)
+            self._submitted = 0
+        self._submitted += 1
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        pools = self._retired + ([self._pool] if self._pool else [])
+        for pool in pools:
+            pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+        self._pool, self._retired = None, []
+
+
+def _init_worker(cpu_slots, workers: int):
+    """Initializer for file-level workers."""
+    global _cpu_slots, _workers
+    _cpu_slots = cpu_slots
+    _workers = workers
+
+
+def _init_page_worker(pdf_path: str):
+    """Initializer for page-range workers: open the document once."""
+    global _page_doc
+    _page_doc = fitz.open(pdf_path)
+
+
+def _page_texts(doc, start: int, end: int):
+    """Yield the text of pages start..end-1, one page at a time."""
+    for i in range(start, end):
+        yield doc[i].get_text("text", flags=TEXT_FLAGS)
 
 
-def extract_text(pdf_path: str) -> tuple[str, str, int]:
-    """Extract text from PDF using PyMuPDF. Returns (filename, text, page_count)."""
+def _write_pages(out, pages) -> int:
+    """Write page texts separated by newlines. Returns chars written."""
+    chars = 0
+    for i, page_text in enumerate(pages):
+        if i:
+            out.write("\n")
+            chars += 1
+        out.write(page_text)
+        chars += len(page_text)
+    return chars
+
+
+def _extract_page_range(start: int, end: int) -> str:
+    return "\n".join(_page_texts(_page_doc, start, end))
+
+
+def _reserve_slots(wanted: int) -> int:
+    """Take up to `wanted` idle worker slots without blocking. Returns count taken."""
+    if _cpu_slots is None:
+        return 0
+    taken = 0
+    while taken < wanted and _cpu_slots.acquire(block=False):
+        taken += 1
+    return taken
+
+
+def extract_text_parallel(pdf_path: str, page_count: int, out) -> int | None:
+    """Extract page ranges of one PDF in parallel, writing them to out in order.
+
+    Only uses worker slots that are currently idle, so the nested pool never
+    oversubscribes the CPU. Returns chars written, or None (having written
+    nothing) if no slots are free.
+    """
+    wanted = min(_workers, page_count // PAGES_PER_RANGE)
+    extra = _reserve_slots(wanted - 1)  # this worker already holds one slot
+    if not extra:
+        return None
+
     try:
-        doc = fitz.open(pdf_path)
-        text = "\n".join(page.get_text() for page in doc)
-        page_count = len(doc)
-        doc.close()
-        return os.path.basename(pdf_path), text, page_count
+        k = extra + 1
+        bounds = [page_count * i // k for i in range(k + 1)]
+        # Short-lived pool: fork so children skip re-importing PyMuPDF
+        with ProcessPoolExecutor(max_workers=k, mp_context=multiprocessing.get_context("fork"),
+                                 initializer=_init_page_worker, initargs=(pdf_path,)) as pool:
+            # map yields ranges in order, so each is written and dropped as it arrives
+            return _write_pages(out, pool.map(_extract_page_range, bounds[:-1], bounds[1:]))
+    finally:
+        for _ in range(extra):
+            _cpu_slots.release()
+
+
+def extract_text(pdf_path: str, output_path: Path) -> tuple[str, int, int]:
+    """Extract text from PDF using PyMuPDF, streaming it to output_path.
+
+    Returns (filename, char_count, page_count); the full text is never held
+    in memory.
+    """
+    filename = os.path.basename(pdf_path)
+    try:
+        with fitz.open(pdf_path) as doc, \
+                output_path.open("w", encoding="utf-8", buffering=1 << 20) as out:
+            page_count = len(doc)
+            chars = None
+            if page_count > PAGE_SPLIT_THRESHOLD:
+                chars = extract_text_parallel(pdf_path, page_count, out)
+            if chars is None:
+                chars = _write_pages(out, _page_texts(doc, 0, page_count))
+        return filename, chars, page_count
     except Exception as e:
-        return os.path.basename(pdf_path), f"ERROR: {e}", 0
+        error = f"ERROR: {e}"
+        output_path.write_text(error, encoding="utf-8")
+        return filename, len(error), 0
 
 
 def process_pdf(args: tuple) -> dict:
-    """Process a single PDF file."""
-    pdf_path, output_dir = args
-    start = time.time()
+    """Process a single PDF file. Text-free or failed PDFs go to the skipped dir."""
+    pdf_path, output_dir, min_density = args
+    output_path = Path(output_dir) / f"{Path(pdf_path).stem}.md"
+
+    # Hold this worker's slot so busy workers aren't lent to page-range pools
+    with _cpu_slots or nullcontext():
+        start = time.time()
+        filename, chars, page_count = extract_text(pdf_path, output_path)
+        extract_time = time.time() - start
 
-    filename, text, page_count = extract_text(pdf_path)
-    extract_time = time.time() - start
+    skip_reason = None
+    if page_count == 0:
+        skip_reason = "error"
+    elif chars / page_count < min_density:
+        skip_reason = "no_text"
 
-    # Save output
-    base_name = Path(filename).stem
-    output_path = Path(output_dir) / f"{base_name}.md"
-    output_path.write_text(text)
+    skipped_path = Path(output_dir) / SKIPPED_DIR / output_path.name
+    if skip_reason:
+        output_path.replace(skipped_path)
+    else:
+        # Drop the copy left by an earlier run that skipped this PDF
+        skipped_path.unlink(missing_ok=True)
 
     return {
         "file": filename,
         "pages": page_count,
         "extract_time": extract_time,
-        "chars": len(text)
+        "chars": chars,
+        "skipped": skip_reason
     }
 
 
+def update_skip_manifest(output_dir: Path, results: list[dict]):
+    """Merge skipped results into the skip manifest and drop files no longer skipped."""
+    manifest_path = output_dir / SKIP_MANIFEST
+    manifest = orjson.loads(manifest_path.read_bytes()) if manifest_path.exists() else {}
+
+    for result in results:
+        if result["skipped"]:
+            manifest[result["file"]] = {
+                "reason": result["skipped"],
+                "pages": result["pages"],
+                "chars": result["chars"]
+            }
+        else:
+            manifest.pop(result["file"], None)
+
+    if manifest or manifest_path.exists():
+        manifest_path.write_bytes(orjson.dumps(manifest, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+
+
 def main():
     parser = argparse.ArgumentParser(description="Fast PDF text extraction")
     parser.add_argument("input_dir", help="Directory containing PDFs")
     parser.add_argument("--output", "-o", default="./output-raw", help="Output directory")
     parser.add_argument("--workers", "-w", type=int, default=8, help="Number of workers")
     parser.add_argument("--limit", "-n", type=int, help="Limit number of files to process")
+    parser.add_argument("--min-density", type=float, default=DEFAULT_MIN_DENSITY,
+                        help="Skip PDFs with fewer chars per page (0 skips only failed PDFs)")
     args = parser.parse_args()
 
     # Setup
     input_dir = Path(args.input_dir)
     output_dir = Path(args.output)
     output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / SKIPPED_DIR).mkdir(exist_ok=True)
 
     # Find PDFs
     pdf_files = list(input_dir.glob("*.pdf"))
@@ -78,10 +261,16 @@ def main():
     start_time = time.time()
     completed = 0
     total_pages = 0
+    results = []
 
-    task_args = [(str(f), str(output_dir)) for f in pdf_files]
+    task_args = [(str(f), str(output_dir), args.min_density) for f in pdf_files]
 
-    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+    # forkserver keeps worker restarts cheap
+    mp_context = multiprocessing.get_context("forkserver")
+    cpu_slots = mp_context.BoundedSemaphore(args.workers)
+
+    with RecyclingProcessPool(max_workers=args.workers, mp_context=mp_context,
+                              initializer=_init_worker, initargs=(cpu_slots, args.workers)) as executor:
         futures = {executor.submit(process_pdf, arg): arg for arg in task_args}
 
         for future in as_completed(futures):
@@ -89,20 +278,29 @@ def main():
                 result = future.result()
                 completed += 1
                 total_pages += result["pages"]
+                results.append(result)
 
                 elapsed = time.time() - start_time
                 rate = completed / elapsed if elapsed > 0 else 0
 
+                skipped = f" [skipped: {result['skipped']}]" if result["skipped"] else ""
                 print(f"[{completed}/{len(pdf_files)}] {result['file']}: "
-                      f"{result['pages']} pages, {result['extract_time']:.3f}s | {rate:.1f} files/sec")
+                      f"{result['pages']} pages, {result['extract_time']:.3f}s{skipped} | {rate:.1f} files/sec")
 
             except Exception as e:
                 print(f"Error: {e}")
 
+    update_skip_manifest(output_dir, results)
+
     # Summary
     total_time = time.time() - start_time
+    no_text_count = sum(1 for r in results if r["skipped"] == "no_text")
+    error_count = sum(1 for r in results if r["skipped"] == "error")
     print()
     print(f"Completed: {completed} files, {total_pages} pages")
+    if no_text_count or error_count:
+        print(f"Skipped: {no_text_count} files without a text layer, {error_count} unreadable "
+              f"-> {output_dir / SKIPPED_DIR}")
     print(f"Total time: {total_time:.1f}s")
     if completed:
         print(f"Average: {total_time/completed:.3f}s per file")
@@ -11,14 +11,17 @@ Usage:
 """
 
 import argparse
-import requests
+import asyncio
+import queue
+import sys
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections.abc import AsyncIterator, Awaitable, Iterable
 from pathlib import Path
-from threading import Lock
 
+import numpy as np
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
+from ollama_client import OllamaClient, positive_int
 
 
 PROMPT_TEMPLATE = """Clean up this university transcript text. Output ONLY the cleaned content.
@@ -35,10 +38,19 @@ Raw text:
 
 Cleaned output (start immediately, no preamble):"""
 
+# Prompts are built by concatenation, not str.format
+PROMPT_PREFIX, PROMPT_SUFFIX = PROMPT_TEMPLATE.split("{text}")
+
 DEFAULT_CHUNK_SIZE = 2000  # characters per chunk
 chunk_size = DEFAULT_CHUNK_SIZE
 
-print_lock = Lock()
+
+def _last_position(positions: np.ndarray, lo: int, hi: int) -> int:
+    """Return the largest position in [lo, hi], or -1 if there is none."""
+    idx = np.searchsorted(positions, hi, side="right") - 1
+    if idx >= 0 and positions[idx] >= lo:
+        return int(positions[idx])
+    return -1
 
 
 def chunk_text(text: str, size: int = None) -> list[str]:
@@ -47,92 +59,188 @@ def chunk_text(text: str, size: int = None) -> list[str]:
     if len(text) <= cs:
         return [text]
 
+    # Index every candidate break point in one pass. UTF-32 gives one
+    # element per character, so positions line up with str indices.
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    newlines = np.flatnonzero(codes == ord("\n"))
+    paragraphs = newlines[:-1][np.diff(newlines) == 1]
+    spaces = np.flatnonzero(codes == ord(" "))
+
     chunks = []
-    remaining = text
+    start = 0
+    end = len(text)
+    stripped_end = len(text.rstrip())
 
-    while remaining:
-        if len(remaining) <= cs:
-            chunks.append(remaining)
+    while start < end:
+        if end - start <= cs:
+            chunks.append(text[start:end])
             break
 
-        # Try to find a good break point (double newline, then single newline)
-        chunk = remaining[:cs]
+        # Window is text[start:start + cs]; break points are absolute offsets
+        limit = start + cs
 
-        # Look for paragraph break
-        break_point = chunk.rfind('\n\n')
-        if break_point == -1 or break_point < cs // 2:
+        # Look for paragraph break (both newlines inside the window)
+        break_point = _last_position(paragraphs, start, limit - 2)
+        if break_point == -1 or break_point - start < cs // 2:
             # Fall back to single newline
-            break_point = chunk.rfind('\n')
-        if break_point == -1 or break_point < cs // 2:
+            break_point = _last_position(newlines, start, limit - 1)
+        if break_point == -1 or break_point - start < cs // 2:
             # Fall back to space
-            break_point = chunk.rfind(' ')
+            break_point = _last_position(spaces, start, limit - 1)
         if break_point == -1:
-            break_point = cs
+            break_point = limit
+
+        chunks.append(text[start:break_point].strip())
 
-        chunks.append(remaining[:break_point].strip())
-        remaining = remaining[break_point:].strip()
+        # Remainder starts after the break, without surrounding whitespace
+        start = break_point
+        end = stripped_end
+        while start < end and text[start].isspace():
+            start += 1
 
     return chunks
 
 
-def clean_chunk_with_ollama(text: str, model: str) -> str:
+async def clean_chunk_with_ollama(text: str, client: OllamaClient) -> str:
     """Use Ollama to clean a single chunk of text."""
-    prompt = PROMPT_TEMPLATE.format(text=text)
+    prompt = PROMPT_PREFIX + text + PROMPT_SUFFIX
 
-    try:
-        resp = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=120
-        )
-        if resp.status_code == 200:
-            response = resp.json().get("response", "").strip()
-            if response:
-                return response
-        return text
-    except requests.Timeout:
-        return text  # Keep original on timeout
-    except Exception:
-        return text  # Keep original on error
-
-
-def clean_with_ollama(text: str, model: str) -> str:
+    response = await client.generate(prompt)
+    if response:
+        return response
+    return text  # Keep original on error or timeout
+
+
+async def clean_with_ollama(text: str, client: OllamaClient) -> str:
     """Clean text by processing in chunks and combining results."""
     chunks = chunk_text(text)
 
     if len(chunks) == 1:
-        return clean_chunk_with_ollama(text, model)
+        return await clean_chunk_with_ollama(text, client)
 
-    # Process each chunk
-    cleaned_chunks = []
-    for chunk in chunks:
-        cleaned = clean_chunk_with_ollama(chunk, model)
-        if cleaned:
-            cleaned_chunks.append(cleaned)
+    # Process all chunks concurrently; gather keeps them in order
+    results = await asyncio.gather(*(clean_chunk_with_ollama(chunk, client) for chunk in chunks))
+    cleaned_chunks = [cleaned for cleaned in results if cleaned]
 
     return "\n\n".join(cleaned_chunks) if cleaned_chunks else text
 
 
-def process_file(args: tuple) -> dict:
-    """Process a single file. Returns result dict."""
-    md_file, output_path, model = args
+def output_writer(outbox: queue.SimpleQueue):
+    """Write files and status lines queued by the event loop, until None arrives.
+
+    Items are (path, bytes) for a file write or str for a status line.
+    Everything already queued is handled before stdout is flushed, so a
+    burst of completions costs one flush instead of one per line.
+    """
+    while True:
+        item = outbox.get()
+        while True:
+            if item is None:
+                sys.stdout.flush()
+                return
+            if isinstance(item, str):
+                sys.stdout.write(item + "\n")
+            else:
+                path, data = item
+                try:
+                    path.write_bytes(data)
+                except OSError as e:
+                    sys.stdout.write(f"Error writing {path}: {e}\n")
+            try:
+                item = outbox.get_nowait()
+            except queue.Empty:
+                break
+        sys.stdout.flush()
+
+
+async def process_file(args: tuple, client: OllamaClient, outbox: queue.SimpleQueue | None = None) -> dict:
+    """Process a single file. Returns result dict.
+
+    With an outbox the write is handed to output_writer; without one (e.g.
+    when a later step reads the output right away) it happens inline.
+    """
+    md_file, output_path = args
     start = time.time()
 
-    raw_text = md_file.read_text()
-    cleaned = clean_with_ollama(raw_text, model)
+    raw = md_file.read_bytes()
+    raw_text = raw.decode("utf-8")
+    cleaned = await clean_with_ollama(raw_text, client)
     elapsed = time.time() - start
 
     if cleaned is None:
         # Error or timeout - keep original
-        output_path.write_text(raw_text)
-        return {"file": md_file.name, "time": elapsed, "status": "error"}
+        data, status = raw, "error"
+    else:
+        data, status = cleaned.encode("utf-8"), "ok"
+
+    if outbox is None:
+        output_path.write_bytes(data)
+    else:
+        outbox.put((output_path, data))
+    return {"file": md_file.name, "time": elapsed, "status": status}
+
+
+async def submit_with_backpressure(jobs: Iterable[Awaitable], limit: int) -> AsyncIterator:
+    """Run jobs with at most `limit` in flight, yielding results as they complete.
+
+    jobs is consumed lazily, so a coroutine (and the file it reads) only
+    exists once a slot frees up.
+    """
+    jobs = iter(jobs)
+    pending = {asyncio.ensure_future(job) for _, job in zip(range(limit), jobs)}
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for _ in done:
+            job = next(jobs, None)
+            if job is not None:
+                pending.add(asyncio.ensure_future(job))
+        for task in done:
+            yield task.result()
+
+
+async def process_all(tasks: list[tuple], model: str, workers: int, start_time: float,
+                      compress: bool = False) -> tuple[int, int]:
+    """Clean all files concurrently, printing progress. Returns (completed, errors)."""
+    completed = 0
+    errors = 0
 
-    output_path.write_text(cleaned)
-    return {"file": md_file.name, "time": elapsed, "status": "ok"}
+    # File writes and console output happen on one thread, off the event loop
+    outbox = queue.SimpleQueue()
+    writer = threading.Thread(target=output_writer, args=(outbox,), name="output-writer")
+    writer.start()
+
+    try:
+        async with OllamaClient(model, concurrency=workers, compress=compress) as client:
+            # Keep one file queued per in-flight file so Ollama never waits on disk
+            jobs = (process_file(task, client, outbox) for task in tasks)
+
+            async for result in submit_with_backpressure(jobs, workers * 2):
+                completed += 1
+                if result["status"] == "error":
+                    errors += 1
+
+                elapsed = time.time() - start_time
+                rate = completed / elapsed if elapsed > 0 else 0
+                remaining = len(tasks) - completed
+                eta_seconds = remaining / rate if rate > 0 else 0
+
+                if eta_seconds > 3600:
+                    eta_str = f"{eta_seconds/3600:.1f}h"
+                elif eta_seconds > 60:
+                    eta_str = f"{eta_seconds/60:.0f}m"
+                else:
+                    eta_str = f"{eta_seconds:.0f}s"
+
+                status = "err" if result["status"] == "error" else "ok"
+                outbox.put(f"[{completed}/{len(tasks)}] {result['file']}: "
+                           f"{result['time']:.1f}s [{status}] | {rate:.1f}/min ETA: {eta_str}")
+    finally:
+        # Drain pending writes before returning
+        outbox.put(None)
+        writer.join()
+
+    return completed, errors
 
 
 def main():
@@ -141,9 +249,10 @@ def main():
     parser.add_argument("--output", "-o", default="./output-clean", help="Output directory")
     parser.add_argument("--model", "-m", default="qwen2.5:7b", help="Ollama model")
     parser.add_argument("--limit", "-n", type=int, help="Limit number of files")
-    parser.add_argument("--workers", "-w", type=int, default=1, help="Parallel workers")
+    parser.add_argument("--workers", "-w", type=positive_int, default=1, help="Concurrent Ollama requests")
     parser.add_argument("--overwrite", action="store_true", help="Overwrite existing output files")
     parser.add_argument("--chunk-size", "-c", type=int, default=DEFAULT_CHUNK_SIZE, help="Chunk size in chars")
+    parser.add_argument("--gzip", action="store_true", help="Gzip request bodies (server must accept it)")
     args = parser.parse_args()
 
     global chunk_size
@@ -178,37 +287,11 @@ def main():
         return
 
     start_time = time.time()
-    completed = 0
-    errors = 0
 
     # Build task list
-    tasks = [(f, output_dir / f.name, args.model) for f in md_files]
-
-    with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        futures = {executor.submit(process_file, task): task for task in tasks}
-
-        for future in as_completed(futures):
-            result = future.result()
-            completed += 1
-            if result["status"] == "error":
-                errors += 1
-
-            elapsed = time.time() - start_time
-            rate = completed / elapsed if elapsed > 0 else 0
-            remaining = len(md_files) - completed
-            eta_seconds = remaining / rate if rate > 0 else 0
-
-            if eta_seconds > 3600:
-                eta_str = f"{eta_seconds/3600:.1f}h"
-            elif eta_seconds > 60:
-                eta_str = f"{eta_seconds/60:.0f}m"
-            else:
-                eta_str = f"{eta_seconds:.0f}s"
+    tasks = [(f, output_dir / f.name) for f in md_files]
 
-            status = "err" if result["status"] == "error" else "ok"
-            with print_lock:
-                print(f"[{completed}/{len(md_files)}] {result['file']}: "
-                      f"{result['time']:.1f}s [{status}] | {rate:.1f}/min ETA: {eta_str}")
+    completed, errors = asyncio.run(process_all(tasks, args.model, args.workers, start_time, args.gzip))
 
     total_time = time.time() - start_time
     print()
@@ -8,20 +8,34 @@ missing legends that span chunk boundaries.
 Usage:
     python 03_extract_legends.py ./output-clean -o ./output-legend-chunk
     python 03_extract_legends.py ./output-clean -o ./output-legend-chunk -n 10
+    python 03_extract_legends.py ./output-clean -o ./output-legend-chunk -w 4  # 4 concurrent requests
 """
 
 import argparse
-import requests
+import asyncio
+import hashlib
+import re
+from collections import OrderedDict
 from pathlib import Path
 
-
-OLLAMA_URL = "http://localhost:11434/api/generate"
+from ollama_client import OllamaClient, positive_int
 
 
 DEFAULT_CHUNK_SIZE = 3000  # characters per chunk
 DEFAULT_OVERLAP = 1000  # overlap between chunks
 chunk_size = DEFAULT_CHUNK_SIZE
 chunk_overlap = DEFAULT_OVERLAP
+use_prefilter = True
+
+# Cheap check run before the LLM: a chunk with none of these can't hold a legend
+LEGEND_HINT_RE = re.compile(
+    r"(?i:\b(?:grades?|grading|legend|quality\s+points?)\b)"
+    r"|\b[A-Z]{1,2}\s*="
+)
+
+# LLM answers keyed by (chunk hash, prompt number), shared across files
+RESPONSE_CACHE_SIZE = 4096
+_response_cache: OrderedDict[tuple[bytes, int], str | None] = OrderedDict()
 
 PROMPT_TEMPLATE = """Extract the transcript's **GRADE LEGEND** section verbatim.
 
@@ -62,24 +76,38 @@ If not found, output: NO_LEGEND
 
 {text}"""
 
+PROMPT_PARTS = tuple(PROMPT_TEMPLATE.split("{text}"))
+PROMPT_PARTS_2 = tuple(PROMPT_TEMPLATE_2.split("{text}"))
+PROMPTS = {1: PROMPT_PARTS, 2: PROMPT_PARTS_2}
 
-def chunk_text(text: str) -> list[str]:
-    """Split text into overlapping chunks using sliding window."""
+
+def chunk_text(text: str) -> list[tuple[int, int]]:
+    """Split text into overlapping chunks using sliding window.
+
+    Returns (start, end) offsets into text, trimmed of surrounding whitespace,
+    so a chunk is only copied out of the transcript when it is sent.
+    """
     cs = chunk_size
     overlap = chunk_overlap
 
     if len(text) <= cs:
-        return [text]
+        return [(0, len(text))]
 
-    chunks = []
+    spans = []
     start = 0
     stride = cs - overlap  # how far to advance each iteration
 
     while start < len(text):
         end = min(start + cs, len(text))
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
+
+        # Trim whitespace by moving the bounds instead of calling strip()
+        lo, hi = start, end
+        while lo < hi and text[lo].isspace():
+            lo += 1
+        while hi > lo and text[hi - 1].isspace():
+            hi -= 1
+        if lo < hi:
+            spans.append((lo, hi))
 
         # If we've reached the end, stop
         if end >= len(text):
@@ -87,71 +115,126 @@ def chunk_text(text: str) -> list[str]:
 
         start += stride
 
-    return chunks
-
-
-def extract_from_chunk(text: str, model: str, prompt_template: str) -> str | None:
-    """Extract legend from a single chunk using given prompt template."""
-    escaped_text = text.replace("{", "{{").replace("}", "}}")
-    prompt = prompt_template.format(text=escaped_text)
-
-    try:
-        resp = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=120
-        )
-        if resp.status_code == 200:
-            response = resp.json().get("response", "").strip()
-            if response and "NO_LEGEND" not in response:
-                return response
-        return None
-    except requests.Timeout:
-        return None
-    except Exception:
-        return None
-
-
-def extract_chunk(text: str, model: str) -> tuple[str | None, int]:
-    """Extract legend from transcript, processing in chunks.
+    return spans
 
-    Returns tuple of (result, prompt_number) where prompt_number is 1 or 2.
+
+async def extract_from_chunk(text: str, client: OllamaClient,
+                             prompt_parts: tuple[str, str]) -> tuple[str | None, bool]:
+    """Extract legend from a single chunk using given (prefix, suffix) prompt parts.
+
+    Returns (legend or None, answered); answered is False when the request
+    itself failed, so the caller can tell that apart from NO_LEGEND.
     """
-    chunks = chunk_text(text)
+    prefix, suffix = prompt_parts
+    prompt = prefix + text + suffix
+
+    response = await client.generate(prompt)
+    if response is None:
+        return None, False
+    if response and "NO_LEGEND" not in response:
+        return response, True
+    return None, True
 
-    # Try each chunk with first prompt
-    for chunk in chunks:
-        result = extract_from_chunk(chunk, model, PROMPT_TEMPLATE)
-        if result:
-            return result, 1
 
-    # If first prompt failed, try second prompt on all chunks
-    for chunk in chunks:
-        result = extract_from_chunk(chunk, model, PROMPT_TEMPLATE_2)
-        if result:
-            return result, 2
+async def extract_cached(text: str, client: OllamaClient, prompt_num: int) -> str | None:
+    """Run extract_from_chunk, reusing the answer for an identical chunk and prompt.
+
+    Failed requests are not cached, so the chunk is retried for later files.
+    """
+    key = (hashlib.blake2b(text.encode(), digest_size=8).digest(), prompt_num)
+    if key in _response_cache:
+        _response_cache.move_to_end(key)
+        return _response_cache[key]
+
+    result, answered = await extract_from_chunk(text, client, PROMPTS[prompt_num])
+    if answered:
+        _response_cache[key] = result
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+    return result
+
+
+async def extract_chunk(text: str, spans: list[tuple[int, int]],
+                        client: OllamaClient) -> tuple[str | None, int]:
+    """Extract legend from transcript, processing the chunk spans from chunk_text.
+
+    Chunks are tried in order so the first hit stops further requests;
+    concurrency comes from processing several files at once. Chunks that
+    fail the LEGEND_HINT_RE prefilter are never sent to either prompt.
+
+    Returns tuple of (result, prompt_number) where prompt_number is 1 or 2.
+    """
+    if use_prefilter:
+        spans = [(start, end) for start, end in spans if LEGEND_HINT_RE.search(text, start, end)]
+
+    # Try each chunk with first prompt, then the second prompt on all chunks
+    for prompt_num in (1, 2):
+        for start, end in spans:
+            result = await extract_cached(text[start:end], client, prompt_num)
+            if result:
+                return result, prompt_num
 
     return None, 0
 
 
+async def process_file(md_file: Path, output_dir: Path, client: OllamaClient,
+                       file_slots: asyncio.Semaphore) -> tuple[str, bool, str]:
+    """Extract the legend for one transcript. Returns (filename, found, status line)."""
+    async with file_slots:
+        text = md_file.read_bytes().decode("utf-8")
+        spans = chunk_text(text)
+        num_chunks = len(spans)
+
+        chunk, prompt_num = await extract_chunk(text, spans, client)
+
+        output_file = output_dir / md_file.with_suffix(".txt").name
+
+        if chunk:
+            output_file.write_bytes(chunk.encode("utf-8"))
+            return md_file.name, True, f"found ({len(chunk)} chars, {num_chunks} chunks, prompt {prompt_num})"
+
+        output_file.write_bytes(b"")
+        return md_file.name, False, f"no legend ({num_chunks} chunks)"
+
+
+async def process_all(md_files: list[Path], output_dir: Path, model: str, workers: int,
+                      compress: bool = False) -> int:
+    """Extract legends from all files concurrently. Returns files with legends."""
+    files_with_chunks = 0
+
+    # At most `workers` files are read and in flight at a time
+    file_slots = asyncio.Semaphore(workers)
+
+    async with OllamaClient(model, concurrency=workers, compress=compress) as client:
+        pending = [process_file(f, output_dir, client, file_slots) for f in md_files]
+
+        for i, next_result in enumerate(asyncio.as_completed(pending), 1):
+            name, found, status = await next_result
+            if found:
+                files_with_chunks += 1
+            print(f"[{i}/{len(md_files)}] {name}... {status}")
+
+    return files_with_chunks
+
+
 def main():
     parser = argparse.ArgumentParser(description="Extract legend chunks from transcripts")
     parser.add_argument("input_dir", help="Directory containing cleaned .md files")
     parser.add_argument("--output", "-o", default="./output-legend-chunk", help="Output directory")
     parser.add_argument("--model", "-m", default="qwen2.5:7b", help="Ollama model")
     parser.add_argument("--limit", "-n", type=int, help="Limit number of files")
+    parser.add_argument("--workers", "-w", type=positive_int, default=1, help="Concurrent Ollama requests")
     parser.add_argument("--overwrite", action="store_true", help="Overwrite existing output files")
     parser.add_argument("--chunk-size", "-c", type=int, default=DEFAULT_CHUNK_SIZE, help="Chunk size in chars")
     parser.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP, help="Overlap between chunks in chars")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every chunk to the LLM")
+    parser.add_argument("--gzip", action="store_true", help="Gzip request bodies (server must accept it)")
     args = parser.parse_args()
 
-    global chunk_size, chunk_overlap
+    global chunk_size, chunk_overlap, use_prefilter
     chunk_size = args.chunk_size
     chunk_overlap = args.overlap
+    use_prefilter = not args.no_prefilter
 
     input_dir = Path(args.input_dir)
     output_dir = Path(args.output)
@@ -174,32 +257,16 @@ def main():
     print(f"Output: {output_dir}")
     print(f"Model: {args.model}")
     print(f"Chunk size: {chunk_size}, overlap: {chunk_overlap}")
+    print(f"Prefilter: {'on' if use_prefilter else 'off'}")
     print(f"Files: {len(md_files)}")
+    print(f"Workers: {args.workers}")
     print()
 
     if not md_files:
         print("No files to process.")
         return
 
-    files_with_chunks = 0
-
-    for i, md_file in enumerate(md_files, 1):
-        print(f"[{i}/{len(md_files)}] {md_file.name}...", end=" ", flush=True)
-
-        text = md_file.read_text()
-        num_chunks = len(chunk_text(text))
-
-        chunk, prompt_num = extract_chunk(text, args.model)
-
-        output_file = output_dir / md_file.with_suffix(".txt").name
-
-        if chunk:
-            files_with_chunks += 1
-            output_file.write_text(chunk)
-            print(f"found ({len(chunk)} chars, {num_chunks} chunks, prompt {prompt_num})")
-        else:
-            output_file.write_text("")
-            print(f"no legend ({num_chunks} chunks)")
+    files_with_chunks = asyncio.run(process_all(md_files, output_dir, args.model, args.workers, args.gzip))
 
     print()
     print(f"Files with legends: {files_with_chunks}/{len(md_files)}")
@@ -7,14 +7,16 @@ Converts extracted legend text into structured CODE,DESCRIPTION CSV format.
 Usage:
     python 04_legends_to_csv.py ./output-legend-chunk -o ./output-legend-csv
     python 04_legends_to_csv.py ./output-legend-chunk -o ./output-legend-csv -n 10
+    python 04_legends_to_csv.py ./output-legend-chunk -o ./output-legend-csv -w 4  # 4 concurrent requests
+    python 04_legends_to_csv.py ./output-legend-chunk -o ./output-legend-csv -b 1  # one legend per request
 """
 
 import argparse
-import requests
+import asyncio
+import re
 from pathlib import Path
 
-
-OLLAMA_URL = "http://localhost:11434/api/generate"
+from ollama_client import NUM_CTX, OllamaClient, positive_int
 
 
 PROMPT_TEMPLATE = """Convert to CSV: CODE,DESCRIPTION
@@ -25,54 +27,220 @@ Only letter codes (A, B, W, WP, AU, I, P). No symbols, no header.
 
 CSV:"""
 
+BATCH_PROMPT_TEMPLATE = """Convert each block below to CSV: CODE,DESCRIPTION
 
-def format_csv(chunk: str, model: str) -> str | None:
-    """Format legend chunk into CSV."""
-    escaped_text = chunk.replace("{", "{{").replace("}", "}}")
-    prompt = PROMPT_TEMPLATE.format(text=escaped_text)
-
-    try:
-        resp = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=120
-        )
-        if resp.status_code != 200:
-            return None
+Only letter codes (A, B, W, WP, AU, I, P). No symbols, no header.
+For each block, output its label line (e.g. BLOCK 1:) followed by that block's CSV.
+
+{text}
+
+CSV:"""
+
+PROMPT_PREFIX, PROMPT_SUFFIX = PROMPT_TEMPLATE.split("{text}")
+BATCH_PROMPT_PREFIX, BATCH_PROMPT_SUFFIX = BATCH_PROMPT_TEMPLATE.split("{text}")
+
+DEFAULT_BATCH_SIZE = 4  # legends packed into one LLM request
+# Packed prompts must fit NUM_CTX with room left for every block's CSV;
+# Ollama silently truncates the start of an oversized prompt
+CHARS_PER_TOKEN = 3  # conservative estimate for sizing prompts
+NUM_PREDICT_PER_LEGEND = 384  # output tokens reserved per block
+# "BLOCK n:" label at the start of a line of batch output
+BLOCK_LABEL_RE = re.compile(r"^[ \t]*BLOCK[ \t]+(\d+)[ \t]*:", re.M)
+
+# "A = Excellent" / "- W: Withdrawn" / "AU – Audit" style legend lines.
+# A bare "-" must have whitespace before it so "A- = 3.7" isn't read as code A.
+LEGEND_LINE_RE = re.compile(r"^[ \t]*(?:[-*\u2022][ \t]*)?([A-Z]{1,4})([ \t]*[=:\u2013]|[ \t]+-)[ \t]*(\S.*?)[ \t\r]*$", re.M)
+# Another "CODE =" inside a description means a multi-column legend
+INLINE_CODE_RE = re.compile(r"\b[A-Z]{1,4}[ \t]*[=:\u2013]")
+MIN_REGEX_ENTRIES = 3  # fewer matches than this goes to the LLM
+
+# A valid row of LLM output: "CODE,DESCRIPTION"
+CSV_ROW_RE = re.compile(r"^[ \t]*([A-Z]{1,4})[ \t]*,[ \t]*(.+?)[ \t\r]*$", re.M)
+
+
+def parse_structured_legend(chunk: str) -> str | None:
+    """Convert an already line-oriented legend to CSV without the LLM.
+
+    Returns None unless at least MIN_REGEX_ENTRIES distinct codes match and
+    matching lines make up most of the chunk, so prose legends still go to
+    the LLM. Multi-column lines and "NOTE:"-style headings are also left to
+    the LLM rather than guessed at.
+    """
+    matches = LEGEND_LINE_RE.findall(chunk)
+    if len(matches) < MIN_REGEX_ENTRIES:
+        return None
 
-        response = resp.json().get("response", "").strip()
-        if not response:
+    for code, sep, desc in matches:
+        if INLINE_CODE_RE.search(desc):
+            return None
+        # Grade codes this long with a colon are almost always headings (NOTE:, GPA:)
+        if len(code) >= 3 and sep.strip() == ":":
             return None
 
-        # Validate and clean CSV
-        lines = []
-        for line in response.split("\n"):
-            line = line.strip()
-            if not line:
-                continue
-            # Skip lines that don't look like CSV
-            if "," not in line:
-                continue
-            parts = line.split(",", 1)
-            if len(parts) != 2:
-                continue
-            code = parts[0].strip()
-            desc = parts[1].strip()
-            # Validate code is letters only, max 4 chars
-            if code and code.isalpha() and len(code) <= 4:
-                lines.append(f"{code},{desc}")
-
-        return "\n".join(lines) if lines else None
-
-    except requests.Timeout:
+    non_empty = sum(1 for line in chunk.split("\n") if line.strip())
+    if len(matches) * 2 < non_empty:
         return None
-    except Exception:
+
+    # First definition of each code wins
+    entries = {}
+    for code, _, desc in matches:
+        entries.setdefault(code, desc)
+    if len(entries) < MIN_REGEX_ENTRIES:
         return None
 
+    return "\n".join(f"{code},{desc}" for code, desc in entries.items())
+
+
+async def format_csv(chunk: str, client: OllamaClient) -> str | None:
+    """Format legend chunk into CSV, using the LLM only when the regex can't."""
+    csv_content = parse_structured_legend(chunk)
+    if csv_content:
+        return csv_content
+
+    prompt = PROMPT_PREFIX + chunk + PROMPT_SUFFIX
+
+    response = await client.generate(prompt)
+    if not response:
+        return None
+
+    return parse_csv_response(response)
+
+
+def parse_csv_response(response: str) -> str | None:
+    """Keep only valid CODE,DESCRIPTION rows from LLM output."""
+    # Parse and validate in one pass: letter code (max 4 chars), comma, description
+    rows = CSV_ROW_RE.findall(response)
+    return "\n".join(f"{code},{desc}" for code, desc in rows) or None
+
+
+def split_batch_response(response: str, count: int) -> list[str] | None:
+    """Split batch output into one part per block, matched by BLOCK n: label.
+
+    Returns None unless labels 1..count each appear exactly once.
+    """
+    pieces = BLOCK_LABEL_RE.split(response)
+    labels = [int(label) for label in pieces[1::2]]
+    if sorted(labels) != list(range(1, count + 1)):
+        return None
+
+    parts = dict(zip(labels, pieces[2::2]))
+    return [parts[n] for n in range(1, count + 1)]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for text, erring high."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_blocks(chunks: list[str], indices: list[int]) -> list[list[int]]:
+    """Group chunk indices so each group's prompt and output fit in NUM_CTX."""
+    overhead = estimate_tokens(BATCH_PROMPT_PREFIX + BATCH_PROMPT_SUFFIX)
+    groups = []
+    group, used = [], overhead
+    for i in indices:
+        cost = estimate_tokens(f"BLOCK {len(group) + 1}:\n{chunks[i]}\n---\n") + NUM_PREDICT_PER_LEGEND
+        if group and used + cost > NUM_CTX:
+            groups.append(group)
+            group, used = [], overhead
+        group.append(i)
+        used += cost
+    if group:
+        groups.append(group)
+    return groups
+
+
+async def format_csv_packed(chunks: list[str], client: OllamaClient) -> list[str | None]:
+    """Format chunks (already sized by pack_blocks) with one batch request.
+
+    Response parts are assigned by their BLOCK n: label. If any label is
+    missing or repeated, every chunk falls back to its own format_csv request.
+    """
+    if len(chunks) == 1:
+        return [await format_csv(chunks[0], client)]
+
+    blocks = "\n---\n".join(f"BLOCK {n}:\n{chunk}" for n, chunk in enumerate(chunks, 1))
+    prompt = BATCH_PROMPT_PREFIX + blocks + BATCH_PROMPT_SUFFIX
+    # pack_blocks left at least NUM_PREDICT_PER_LEGEND per block; output may use all of it
+    num_predict = NUM_CTX - estimate_tokens(prompt)
+
+    response = await client.generate(prompt, options={"num_predict": num_predict})
+    parts = split_batch_response(response, len(chunks)) if response else None
+    if parts:
+        return [parse_csv_response(part) for part in parts]
+
+    return list(await asyncio.gather(*(format_csv(chunk, client) for chunk in chunks)))
+
+
+async def format_csv_batch(chunks: list[str], client: OllamaClient) -> list[str | None]:
+    """Format several legend chunks, packing those the regex can't handle into few prompts.
+
+    Chunks are grouped by pack_blocks so no prompt overflows NUM_CTX; a chunk
+    that only fits on its own gets a plain format_csv request.
+    """
+    results = [parse_structured_legend(chunk) for chunk in chunks]
+    todo = [i for i, csv_content in enumerate(results) if not csv_content]
+
+    groups = pack_blocks(chunks, todo)
+    outputs = await asyncio.gather(*(format_csv_packed([chunks[i] for i in group], client) for group in groups))
+    for group, group_results in zip(groups, outputs):
+        for i, csv_content in zip(group, group_results):
+            results[i] = csv_content
+
+    return results
+
+
+async def process_file(txt_file: Path, output_dir: Path, client: OllamaClient,
+                       file_slots: asyncio.Semaphore) -> tuple[str, str | None]:
+    """Format one legend chunk file. Returns (filename, csv content or None)."""
+    async with file_slots:
+        chunk = txt_file.read_bytes().decode("utf-8")
+        csv_content = await format_csv(chunk, client)
+
+        output_file = output_dir / txt_file.with_suffix(".csv").name
+        output_file.write_bytes(csv_content.encode("utf-8") if csv_content else b"")
+
+        return txt_file.name, csv_content
+
+
+async def process_batch(txt_files: list[Path], output_dir: Path, client: OllamaClient,
+                        file_slots: asyncio.Semaphore) -> list[tuple[str, str | None]]:
+    """Format a batch of legend chunk files. Returns [(filename, csv content or None)]."""
+    async with file_slots:
+        chunks = [txt_file.read_bytes().decode("utf-8") for txt_file in txt_files]
+        results = await format_csv_batch(chunks, client)
+
+        for txt_file, csv_content in zip(txt_files, results):
+            output_file = output_dir / txt_file.with_suffix(".csv").name
+            output_file.write_bytes(csv_content.encode("utf-8") if csv_content else b"")
+
+        return [(txt_file.name, csv_content) for txt_file, csv_content in zip(txt_files, results)]
+
+
+async def process_all(txt_files: list[Path], output_dir: Path, model: str, workers: int,
+                      compress: bool = False, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Format all legend chunks concurrently, batch_size files per request. Returns successful count."""
+    successful = 0
+    i = 0
+
+    # At most `workers` batches are read and in flight at a time
+    file_slots = asyncio.Semaphore(workers)
+    batches = [txt_files[n:n + batch_size] for n in range(0, len(txt_files), batch_size)]
+
+    async with OllamaClient(model, concurrency=workers, compress=compress) as client:
+        pending = [process_batch(batch, output_dir, client, file_slots) for batch in batches]
+
+        for next_result in asyncio.as_completed(pending):
+            for name, csv_content in await next_result:
+                i += 1
+                if csv_content:
+                    successful += 1
+                    line_count = len(csv_content.split("\n"))
+                    print(f"[{i}/{len(txt_files)}] {name}... {line_count} entries")
+                else:
+                    print(f"[{i}/{len(txt_files)}] {name}... failed")
+
+    return successful
+
 
 def main():
     parser = argparse.ArgumentParser(description="Format legend chunks into CSV")
@@ -80,7 +248,11 @@ def main():
     parser.add_argument("--output", "-o", default="./output-legend-csv", help="Output directory")
     parser.add_argument("--model", "-m", default="qwen2.5:7b", help="Ollama model")
     parser.add_argument("--limit", "-n", type=int, help="Limit number of files")
+    parser.add_argument("--workers", "-w", type=positive_int, default=1, help="Concurrent Ollama requests")
+    parser.add_argument("--batch-size", "-b", type=positive_int, default=DEFAULT_BATCH_SIZE,
+                        help="Legends packed into one Ollama request")
     parser.add_argument("--overwrite", action="store_true", help="Overwrite existing output files")
+    parser.add_argument("--gzip", action="store_true", help="Gzip request bodies (server must accept it)")
     args = parser.parse_args()
 
     input_dir = Path(args.input_dir)
@@ -106,30 +278,16 @@ def main():
     print(f"Output: {output_dir}")
     print(f"Model: {args.model}")
     print(f"Files: {len(txt_files)}")
+    print(f"Workers: {args.workers}")
+    print(f"Batch size: {args.batch_size}")
     print()
 
     if not txt_files:
         print("No files to process.")
         return
 
-    successful = 0
-
-    for i, txt_file in enumerate(txt_files, 1):
-        print(f"[{i}/{len(txt_files)}] {txt_file.name}...", end=" ", flush=True)
-
-        chunk = txt_file.read_text()
-        csv_content = format_csv(chunk, args.model)
-
-        output_file = output_dir / txt_file.with_suffix(".csv").name
-
-        if csv_content:
-            successful += 1
-            output_file.write_text(csv_content)
-            line_count = len(csv_content.split("\n"))
-            print(f"{line_count} entries")
-        else:
-            output_file.write_text("")
-            print("failed")
+    successful = asyncio.run(process_all(txt_files, output_dir, args.model, args.workers, args.gzip,
+                                         args.batch_size))
 
     print()
     print(f"Successful: {successful}/{len(txt_files)}")
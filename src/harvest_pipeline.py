@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Streaming pipeline: run steps 1-4 concurrently.
+
+Each PDF moves on to the next step as soon as the previous one finishes,
+so PyMuPDF extraction (CPU) overlaps with the Ollama steps (GPU). Steps are
+connected by bounded queues; a full queue pauses the step feeding it.
+
+Intermediate files are written to the same directories as the standalone
+scripts, so existing outputs are skipped (unless --overwrite) and any step
+can still be re-run on its own.
+
+Usage:
+    python harvest_pipeline.py /path/to/pdfs
+    python harvest_pipeline.py /path/to/pdfs -o . -n 100  # limit to 100 files
+    python harvest_pipeline.py /path/to/pdfs --llm-workers 4  # 4 concurrent Ollama requests
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import time
+from importlib import import_module
+from pathlib import Path
+
+from ollama_client import OllamaClient, positive_int
+
+pdf_to_text = import_module("01_pdf_to_text")
+clean_text = import_module("02_clean_text")
+extract_legends = import_module("03_extract_legends")
+legends_to_csv = import_module("04_legends_to_csv")
+
+
+DEFAULT_QUEUE_SIZE = 16
+
+
+async def run_stage(name: str, worker, inbox: asyncio.Queue, outbox: asyncio.Queue | None,
+                    consumers: int, counts: dict):
+    """Feed items from inbox through worker; forward non-None results to outbox.
+
+    A None item on inbox means the previous step is done. Once every consumer
+    has stopped, one None per consumer is sent on to outbox.
+    """
+    async def consume():
+        while (item := await inbox.get()) is not None:
+            result = await worker(item)
+            counts[name] += 1
+            if result is not None and outbox is not None:
+                await outbox.put(result)
+
+    await asyncio.gather(*(consume() for _ in range(consumers)))
+
+    if outbox is not None:
+        for _ in range(consumers):
+            await outbox.put(None)
+
+
+async def run_pipeline(pdf_files: list[Path], dirs: dict[str, Path], args) -> dict:
+    """Run all four steps over pdf_files. Returns per-step completion counts."""
+    raw_dir, clean_dir, legend_dir, csv_dir = dirs["raw"], dirs["clean"], dirs["legend"], dirs["csv"]
+    counts = {"extract": 0, "skipped": 0, "clean": 0, "legend": 0, "csv": 0}
+
+    raw_queue = asyncio.Queue(args.queue_size)
+    clean_queue = asyncio.Queue(args.queue_size)
+    legend_queue = asyncio.Queue(args.queue_size)
+
+    loop = asyncio.get_running_loop()
+    consumers = args.llm_workers
+    mp_context = multiprocessing.get_context("forkserver")
+    cpu_slots = mp_context.BoundedSemaphore(args.workers)
+    extract_results = []
+
+    with pdf_to_text.RecyclingProcessPool(max_workers=args.workers, mp_context=mp_context,
+                                          initializer=pdf_to_text._init_worker,
+                                          initargs=(cpu_slots, args.workers)) as pool:
+        async with OllamaClient(args.model, concurrency=consumers, compress=args.gzip) as client:
+
+            async def extract(pdf: Path) -> Path | None:
+                raw_file = raw_dir / f"{pdf.stem}.md"
+                skipped_file = raw_dir / pdf_to_text.SKIPPED_DIR / raw_file.name
+                counts["extract"] += 1
+                if not args.overwrite:
+                    # raw_file wins over a stale skipped copy
+                    if raw_file.exists():
+                        return raw_file
+                    if skipped_file.exists():
+                        counts["skipped"] += 1
+                        return None
+                result = await loop.run_in_executor(
+                    pool, pdf_to_text.process_pdf, (str(pdf), str(raw_dir), args.min_density))
+                extract_results.append(result)
+                skipped = f" [skipped: {result['skipped']}]" if result["skipped"] else ""
+                print(f"[extract] {result['file']}: {result['pages']} pages, "
+                      f"{result['extract_time']:.3f}s{skipped}")
+                if result["skipped"]:
+                    counts["skipped"] += 1
+                    return None
+                return raw_file
+
+            async def produce():
+                # Keep a few PDFs ahead of the pool; raw_queue applies backpressure
+                in_flight = asyncio.Semaphore(args.workers * 2)
+
+                async def extract_one(pdf: Path):
+                    try:
+                        raw_file = await extract(pdf)
+                        if raw_file is not None:
+                            await raw_queue.put(raw_file)
+                    finally:
+                        in_flight.release()
+
+                tasks = []
+                for pdf in pdf_files:
+                    await in_flight.acquire()
+                    tasks.append(asyncio.create_task(extract_one(pdf)))
+                await asyncio.gather(*tasks)
+
+                for _ in range(consumers):
+                    await raw_queue.put(None)
+
+            legend_slots = asyncio.Semaphore(consumers)
+            csv_slots = asyncio.Semaphore(consumers)
+
+            async def clean(raw_file: Path) -> Path:
+                clean_file = clean_dir / raw_file.name
+                if args.overwrite or not clean_file.exists():
+                    result = await clean_text.process_file((raw_file, clean_file), client)
+                    print(f"[clean] {result['file']}: {result['time']:.1f}s [{result['status']}]")
+                return clean_file
+
+            async def legend(clean_file: Path) -> Path | None:
+                legend_file = legend_dir / clean_file.with_suffix(".txt").name
+                if args.overwrite or not legend_file.exists():
+                    name, _, status = await extract_legends.process_file(
+                        clean_file, legend_dir, client, legend_slots)
+                    print(f"[legend] {name}: {status}")
+                # Only files with a legend go on to CSV formatting
+                return legend_file if legend_file.stat().st_size > 0 else None
+
+            async def csv(legend_file: Path) -> None:
+                csv_file = csv_dir / legend_file.with_suffix(".csv").name
+                if args.overwrite or not csv_file.exists():
+                    name, csv_content = await legends_to_csv.process_file(
+                        legend_file, csv_dir, client, csv_slots)
+                    entries = len(csv_content.split("\n")) if csv_content else 0
+                    print(f"[csv] {name}: {f'{entries} entries' if entries else 'failed'}")
+                return None
+
+            await asyncio.gather(
+                produce(),
+                run_stage("clean", clean, raw_queue, clean_queue, consumers, counts),
+                run_stage("legend", legend, clean_queue, legend_queue, consumers, counts),
+                run_stage("csv", csv, legend_queue, None, consumers, counts),
+            )
+
+    pdf_to_text.update_skip_manifest(raw_dir, extract_results)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the full harvest pipeline as one streaming job")
+    parser.add_argument("input_dir", help="Directory containing PDFs")
+    parser.add_argument("--output", "-o", default=".", help="Root directory for the output-* directories")
+    parser.add_argument("--model", "-m", default="qwen2.5:7b", help="Ollama model")
+    parser.add_argument("--limit", "-n", type=int, help="Limit number of files")
+    parser.add_argument("--workers", "-w", type=positive_int, default=8, help="PDF extraction processes")
+    parser.add_argument("--llm-workers", type=positive_int, default=1, help="Concurrent Ollama requests")
+    parser.add_argument("--min-density", type=float, default=pdf_to_text.DEFAULT_MIN_DENSITY,
+                        help="Skip PDFs with fewer chars per page (0 skips only failed PDFs)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="Max files waiting between steps")
+    parser.add_argument("--overwrite", action="store_true", help="Overwrite existing output files")
+    parser.add_argument("--gzip", action="store_true", help="Gzip request bodies (server must accept it)")
+    args = parser.parse_args()
+
+    input_dir = Path(args.input_dir)
+    output_root = Path(args.output)
+    dirs = {
+        "raw": output_root / "output-raw",
+        "clean": output_root / "output-clean",
+        "legend": output_root / "output-legend-chunk",
+        "csv": output_root / "output-legend-csv",
+    }
+    for d in dirs.values():
+        d.mkdir(parents=True, exist_ok=True)
+    (dirs["raw"] / pdf_to_text.SKIPPED_DIR).mkdir(exist_ok=True)
+
+    pdf_files = sorted(input_dir.glob("*.pdf"))
+    if args.limit:
+        pdf_files = pdf_files[:args.limit]
+
+    print(f"Found {len(pdf_files)} PDFs")
+    print(f"Output: {output_root}")
+    print(f"Model: {args.model}")
+    print(f"Workers: {args.workers} extract, {args.llm_workers} LLM")
+    print()
+
+    if not pdf_files:
+        print("No files to process.")
+        return
+
+    start_time = time.time()
+    counts = asyncio.run(run_pipeline(pdf_files, dirs, args))
+    total_time = time.time() - start_time
+
+    print()
+    print(f"Extracted: {counts['extract']} ({counts['skipped']} skipped: no text or unreadable), cleaned: {counts['clean']}, "
+          f"legend checked: {counts['legend']}, CSV: {counts['csv']}")
+    print(f"Total time: {total_time:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Shared async Ollama client for the LLM steps (02-04).
+
+A single httpx.AsyncClient is reused for every request so connections stay
+open, and a semaphore caps how many generations are in flight at once.
+Every request asks Ollama to keep the model resident, so idle gaps between
+files never trigger an unload/reload.
+
+Request bodies can optionally be gzip-compressed. Stock Ollama does not
+decompress request bodies, so only enable this when the server sits behind
+a proxy (or is a build) that accepts Content-Encoding: gzip.
+"""
+
+import argparse
+import asyncio
+import gzip
+
+import httpx
+import orjson
+
+
+OLLAMA_URL = "http://localhost:11434/api/generate"
+
+KEEP_ALIVE = -1  # keep the model loaded indefinitely
+NUM_CTX = 4096  # fixed context size; changing it between calls forces a reload
+GZIP_MIN_BYTES = 1024  # smaller bodies aren't worth compressing
+
+
+class OllamaClient:
+    """Bounded-concurrency client for Ollama's /api/generate endpoint."""
+
+    def __init__(self, model: str, concurrency: int = 1, timeout: float = 120, compress: bool = False):
+        self.model = model
+        self.compress = compress
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            # Time spent waiting for a pooled connection is not a request timeout
+            timeout=httpx.Timeout(timeout, pool=None),
+            limits=httpx.Limits(
+                max_connections=concurrency * 4,
+                max_keepalive_connections=concurrency * 2,
+            ),
+            headers={"Connection": "keep-alive", "Content-Type": "application/json"},
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def generate(self, prompt: str, options: dict | None = None) -> str | None:
+        """Run a single prompt. Returns the stripped response, or None on failure.
+
+        options are merged over the default Ollama options (num_ctx).
+        """
+        async with self._semaphore:
+            try:
+                # orjson encodes straight to UTF-8 bytes, no intermediate str
+                body = orjson.dumps({
+                    "model": self.model,
+                    "prompt": prompt,
+                    "stream": False,
+                    "keep_alive": KEEP_ALIVE,
+                    "options": {"num_ctx": NUM_CTX, **(options or {})}
+                })
+                headers = None
+                if self.compress and len(body) >= GZIP_MIN_BYTES:
+                    body = gzip.compress(body, compresslevel=1)
+                    headers = {"Content-Encoding": "gzip"}
+                resp = await self._client.post(OLLAMA_URL, content=body, headers=headers)
+                if resp.status_code != 200:
+                    return None
+                return orjson.loads(resp.content).get("response", "").strip()
+            except httpx.TimeoutException:
+                return None
+            except Exception:
+                return None
+
+
+def positive_int(value: str) -> int:
+    """argparse type for worker and batch counts, which must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
@@ -0,0 +1,90 @@
+"""Tests for the non-LLM parsing in 04_legends_to_csv.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from importlib import import_module
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+legends_to_csv = import_module("04_legends_to_csv")
+parse_structured_legend = legends_to_csv.parse_structured_legend
+split_batch_response = legends_to_csv.split_batch_response
+pack_blocks = legends_to_csv.pack_blocks
+estimate_tokens = legends_to_csv.estimate_tokens
+
+
+class ParseStructuredLegendTest(unittest.TestCase):
+
+    def test_single_column_legend(self):
+        chunk = "A = Excellent\nB = Good\n- W: Withdrawn\nAU – Audit"
+        self.assertEqual(parse_structured_legend(chunk),
+                         "A,Excellent\nB,Good\nW,Withdrawn\nAU,Audit")
+
+    def test_crlf_line_endings_stripped(self):
+        chunk = "A = Excellent\r\nB = Good\r\nC = Fair\r\n"
+        self.assertEqual(parse_structured_legend(chunk), "A,Excellent\nB,Good\nC,Fair")
+
+    def test_multi_column_legend_goes_to_llm(self):
+        chunk = ("A = Excellent    W = Withdrawn\n"
+                 "B = Good    I = Incomplete\n"
+                 "C = Fair    AU = Audit")
+        self.assertIsNone(parse_structured_legend(chunk))
+
+    def test_headings_go_to_llm(self):
+        chunk = ("NOTE: Grades below are final\n"
+                 "A = Excellent\nB = Good\nC = Fair\n"
+                 "GPA: 4.0 scale")
+        self.assertIsNone(parse_structured_legend(chunk))
+
+    def test_short_codes_with_colon_are_kept(self):
+        chunk = "A: Excellent\nB: Good\nWP: Withdrawn Passing"
+        self.assertEqual(parse_structured_legend(chunk),
+                         "A,Excellent\nB,Good\nWP,Withdrawn Passing")
+
+
+class SplitBatchResponseTest(unittest.TestCase):
+
+    def test_parts_follow_labels_not_position(self):
+        response = "BLOCK 2:\nB,Good\n---\nBLOCK 1:\nA,Excellent"
+        parts = split_batch_response(response, 2)
+        self.assertEqual([part.strip("-\n") for part in parts], ["A,Excellent", "B,Good"])
+
+    def test_missing_label_rejected(self):
+        # Right number of parts, but block 2 dropped and block 1 split in two
+        response = "BLOCK 1:\nA,Excellent\nBLOCK 1:\nB,Good\nBLOCK 3:\nW,Withdrawn"
+        self.assertIsNone(split_batch_response(response, 3))
+
+    def test_extra_label_rejected(self):
+        response = "BLOCK 1:\nA,Excellent\nBLOCK 2:\nB,Good\nBLOCK 3:\nC,Fair"
+        self.assertIsNone(split_batch_response(response, 2))
+
+
+class PackBlocksTest(unittest.TestCase):
+
+    def test_small_legends_share_a_prompt(self):
+        chunks = ["A means excellent work"] * 4
+        self.assertEqual(pack_blocks(chunks, [0, 1, 2, 3]), [[0, 1, 2, 3]])
+
+    def test_groups_fit_context(self):
+        # Four ~3 KB legends from step 03 can't all share one prompt
+        chunks = ["A means excellent work. " * 125] * 4
+        groups = pack_blocks(chunks, [0, 1, 2, 3])
+        self.assertGreater(len(groups), 1)
+        for group in groups:
+            blocks = "\n---\n".join(f"BLOCK {n}:\n{chunks[i]}" for n, i in enumerate(group, 1))
+            prompt = legends_to_csv.BATCH_PROMPT_PREFIX + blocks + legends_to_csv.BATCH_PROMPT_SUFFIX
+            reserved = legends_to_csv.NUM_PREDICT_PER_LEGEND * len(group)
+            self.assertLessEqual(estimate_tokens(prompt) + reserved, legends_to_csv.NUM_CTX)
+
+    def test_oversized_legend_goes_alone(self):
+        chunks = ["x" * 20000, "A means excellent work"]
+        self.assertEqual(pack_blocks(chunks, [0, 1]), [[0], [1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+"""Tests for worker recycling in 01_pdf_to_text.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import multiprocessing
+import os
+import sys
+import unittest
+from concurrent.futures import wait
+from importlib import import_module
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+pdf_to_text = import_module("01_pdf_to_text")
+
+
+class RecyclingProcessPoolTest(unittest.TestCase):
+
+    def test_runs_past_worker_retirement(self):
+        # ProcessPoolExecutor(max_tasks_per_child=...) hangs here on Python 3.11
+        workers = 2
+        tasks = workers * pdf_to_text.MAX_TASKS_PER_CHILD * 2 + 1
+        mp_context = multiprocessing.get_context("forkserver")
+
+        pool = pdf_to_text.RecyclingProcessPool(max_workers=workers, mp_context=mp_context)
+        not_done = set()
+        try:
+            futures = [pool.submit(os.getpid) for _ in range(tasks)]
+            done, not_done = wait(futures, timeout=120)
+            self.assertFalse(not_done, f"{len(not_done)} of {tasks} tasks never finished")
+            # Three pools' worth of submissions means workers really were replaced
+            self.assertGreater(len({future.result() for future in done}), workers)
+        finally:
+            # Don't block on a hung pool; the failed assertion is the report
+            pool.shutdown(wait=not not_done, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    unittest.main()